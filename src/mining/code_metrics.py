@@ -0,0 +1,381 @@
+"""
+This module implements a native engine for the size metrics of Java code. The metrics are computed directly from the
+blobs of the Git object database, without building the project or scanning it with SonarQube, so that the evolution
+of the size of a repository can be traced quickly along its whole history.
+
+Per-file measures are cached by blob hash and the totals of the repository are updated commit by commit applying only
+the deltas of the changed files.
+
+N.B. the scope of the measures is narrower than SonarQube one: only the Java sources of the main code are measured,
+while SonarQube also measures the other languages (e.g. the XML of the POMs). Therefore, the measures are saved with the
+NATIVE_ prefix, so that they are not mistaken for the SonarQube ones; their agreement with the SonarQube measures can be
+computed with validate_size_metrics.
+"""
+
+import csv
+import re
+import time
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path, PurePosixPath
+from typing import Optional
+
+import git  # GitPython
+
+from print_utils import print_progress, print_major_step, print_info, print_warning
+from repo import clear_repo
+
+SIZE_METRICS = ["LINES", "NCLOC", "COMMENT_LINES", "FILES", "DIRECTORIES", "CLASSES", "FUNCTIONS"]
+
+NATIVE_PREFIX = 'NATIVE_'
+NATIVE_SIZE_METRICS = [NATIVE_PREFIX + metric for metric in SIZE_METRICS]  # dataset columns of the native measures
+
+# Measures computed on each file, FILES and DIRECTORIES are computed on the whole repository
+FILE_METRICS = ["LINES", "NCLOC", "COMMENT_LINES", "CLASSES", "FUNCTIONS"]
+
+JAVA_KEYWORDS = {'abstract', 'assert', 'boolean', 'break', 'byte', 'case', 'catch', 'char', 'class', 'const',
+                 'continue', 'default', 'do', 'double', 'else', 'enum', 'extends', 'final', 'finally', 'float', 'for',
+                 'goto', 'if', 'implements', 'import', 'instanceof', 'int', 'interface', 'long', 'native', 'new',
+                 'package', 'private', 'protected', 'public', 'return', 'short', 'static', 'strictfp', 'super',
+                 'switch', 'synchronized', 'this', 'throw', 'throws', 'transient', 'try', 'void', 'volatile', 'while',
+                 'yield'}
+
+NOT_DECLARATION_PREFIXES = {'new', 'return', 'throw', 'else', 'case', 'yield', 'assert', 'instanceof', 'record'}
+
+CLASS_DECLARATION = re.compile(r'(?<![\w$.])(?:class|interface|enum)\s+[A-Za-z_$][\w$]*'
+                               r'|(?<![\w$.])record\s+[A-Za-z_$][\w$]*\s*[(<]')
+
+# A method (or constructor) declaration is a name followed by the parameters list and then by a body or, for abstract
+# and interface methods, by a semicolon. The word preceding the name (the return type or a modifier) allows to tell
+# declarations apart from method invocations
+METHOD_DECLARATION = re.compile(r'(?:(?<![\w$])(?P<prev>[\w$]+)\s+|(?P<type>[]>])\s*|(?P<block>[;{}])\s*)'
+                                r'(?P<name>[A-Za-z_$][\w$]*)\s*\((?P<params>[^;{}()]*(?:\([^;{}()]*\)[^;{}()]*)*)\)'
+                                r'\s*(?:\[\s*]\s*)*(?:throws\s+[\w$.,\s<>]+)?'
+                                r'\s*(?P<end>\{|;|default\b)')
+
+
+def is_main_java_source(path: str) -> bool:
+    """
+    Checks if a file is a Java source of the main code. Like SonarQube size measures, test sources (src/test/java) and
+    the files outside the Maven source directories are not measured
+
+    :param path: path of the file in the repository
+    :return: True if the file is measured, False otherwise
+    """
+    return path.endswith('.java') and '/src/main/java/' in '/' + path
+
+
+def java_file_metrics(source: str) -> dict[str, int]:
+    """
+    Computes the size metrics of a Java source file, following SonarQube definitions: LINES are the physical lines,
+    NCLOC the lines containing at least a character of code, COMMENT_LINES the lines containing a significant comment
+    (i.e. not empty and not made only of special characters) except the file header (e.g. the license), CLASSES the
+    classes, interfaces, enums, annotations and records (nested included) and FUNCTIONS the methods and constructors
+
+    :param source: content of the file
+    :return: dictionary with the measures of the file
+    """
+    lines = re.split(r'\r\n|\r|\n', source)
+    code_lines = set()
+    comment_lines = set()
+    code = []  # source without comments and literals, used to look up declarations
+
+    line = 0
+    i = 0
+    length = len(source)
+    while i < length:
+        c = source[i]
+        if c == '\n' or (c == '\r' and source[i + 1:i + 2] != '\n'):
+            line += 1
+            code.append('\n')
+            i += 1
+        elif c == '\r':
+            i += 1
+        elif c in ' \t\f':
+            code.append(' ')
+            i += 1
+        elif source.startswith('//', i):
+            end = source.find('\n', i)
+            end = length if end < 0 else end
+            if code_lines and re.search(r'\w', source[i + 2:end]):
+                comment_lines.add(line)
+            i = end
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            end = length if end < 0 else end + 2
+            for offset, comment_line in enumerate(re.split(r'\r\n|\r|\n', source[i:end])):
+                if code_lines and re.search(r'\w', comment_line.replace('/*', '').replace('*/', '')):
+                    comment_lines.add(line + offset)
+            newlines = len(re.findall(r'\r\n|\r|\n', source[i:end]))
+            line += newlines
+            code.append(' ' + '\n' * newlines)
+            i = end
+        elif source.startswith('"""', i):
+            end = source.find('"""', i + 3)
+            while end > 0 and source[end - 1] == '\\':
+                end = source.find('"""', end + 1)
+            end = length if end < 0 else end + 3
+            newlines = len(re.findall(r'\r\n|\r|\n', source[i:end]))
+            code_lines.update(range(line, line + newlines + 1))
+            line += newlines
+            code.append('""' + '\n' * newlines)
+            i = end
+        elif c == '"' or c == "'":
+            end = i + 1
+            while end < length and source[end] not in (c, '\n'):
+                end += 2 if source[end] == '\\' else 1
+            end = min(end + 1, length)
+            code_lines.add(line)
+            code.append(c + c)
+            i = end
+        else:
+            code_lines.add(line)
+            code.append(c)
+            i += 1
+
+    code = ''.join(code)
+
+    return {
+        'LINES': len(lines),
+        'NCLOC': len(code_lines),
+        'COMMENT_LINES': len(comment_lines),
+        'CLASSES': len(CLASS_DECLARATION.findall(code)),
+        'FUNCTIONS': count_methods(code)
+    }
+
+
+def count_methods(code: str) -> int:
+    """
+    Counts the methods and constructors declared in Java code (stripped of comments and literals)
+
+    :param code: code to look up
+    :return: number of methods and constructors
+    """
+    count = 0
+    for declaration in METHOD_DECLARATION.finditer(code):
+        if declaration.group('name') in JAVA_KEYWORDS or declaration.group('prev') in NOT_DECLARATION_PREFIXES:
+            continue  # e.g. if (...) {...}, new Foo() {...}, return foo();
+        if declaration.group('block') is not None and declaration.group('end') != '{':
+            continue  # invocations used as statements, e.g. foo();
+        if declaration.group('type') == '>' and code[declaration.start('type') - 1] == '-':
+            continue  # invocations as body of lambdas, e.g. () -> foo();
+        if declaration.group('type') == '>' and is_type_arguments_of_invocation(code, declaration.start('type')):
+            continue  # invocations with explicit type arguments, e.g. Collections.<String>emptyList();
+        count += 1
+    return count
+
+
+def is_type_arguments_of_invocation(code: str, end: int) -> bool:
+    """
+    Checks if the angle brackets closed at the given position are the explicit type arguments of a method invocation,
+    i.e. if they follow a dot
+
+    :param code: code to look up
+    :param end: position of the closing angle bracket
+    :return: True if the brackets follow a dot, False otherwise
+    """
+    depth = 0
+    for position in range(end, -1, -1):
+        if code[position] == '>':
+            depth += 1
+        elif code[position] == '<':
+            depth -= 1
+            if not depth:
+                return code[:position].rstrip().endswith('.')
+        elif code[position] in ';{}()':
+            break
+    return False
+
+
+class SizeMetricsEngine:
+    """
+    Computes incrementally the size metrics of the Java code of a repository, commit by commit
+    """
+
+    def __init__(self, git_repo: git.Repo):
+        """
+        :param git_repo: Git repository from which blobs are read
+        """
+        self.git_repo = git_repo
+        self.blob_cache: dict[str, dict[str, int]] = {}  # blob hash -> measures of the file
+        self.files: dict[str, str] = {}  # path -> blob hash of the files in the current snapshot
+        self.directories: Counter = Counter()  # directory -> number of files in the current snapshot
+        self.totals: dict[str, int] = dict.fromkeys(FILE_METRICS, 0)
+        self.last_commit: Optional[str] = None
+
+    def update(self, commit) -> None:
+        """
+        Moves the snapshot to the given commit. If the commit is the only child of the last analyzed one, the deltas
+        are taken from its modified files; otherwise (e.g. merge commits, which have no modified files, or commits
+        from another branch) they are taken from the diff between the trees of the two commits
+
+        :param commit: PyDriller commit
+        :return: None
+        """
+        try:
+            self._move(commit)
+        except BaseException:
+            self.reset()  # the snapshot may be partially moved, so it is rebuilt from scratch at the next commit
+            raise
+
+    def reset(self) -> None:
+        """
+        Empties the snapshot (the measures of the blobs are kept)
+
+        :return: None
+        """
+        self.files = {}
+        self.directories = Counter()
+        self.totals = dict.fromkeys(FILE_METRICS, 0)
+        self.last_commit = None
+
+    def _move(self, commit) -> None:
+        """
+        Moves the snapshot to the given commit (see update)
+
+        :param commit: PyDriller commit
+        :return: None
+        """
+        tree = self.git_repo.commit(commit.hash).tree
+
+        if self.last_commit is not None and commit.parents == [self.last_commit]:
+            for modified_file in commit.modified_files:
+                if modified_file.old_path is not None:
+                    self._remove(modified_file.old_path)
+                if modified_file.new_path is not None:
+                    self._add(modified_file.new_path, tree)
+        else:
+            if self.last_commit is None:
+                for item in tree.traverse():
+                    if item.type == 'blob':
+                        self._add(item.path, tree)
+                self.last_commit = commit.hash
+                return
+
+            for changed_file in self.git_repo.commit(self.last_commit).diff(commit.hash):
+                if changed_file.a_path is not None and not changed_file.new_file:
+                    self._remove(changed_file.a_path)
+                if changed_file.b_path is not None and not changed_file.deleted_file:
+                    self._add(changed_file.b_path, tree)
+
+        self.last_commit = commit.hash
+
+    def measures(self, analysis: dict[str, str | int | None]) -> None:
+        """
+        Saves the measures of the current snapshot
+
+        :param analysis: dictionary where to save information
+        :return: None
+        """
+        for metric in FILE_METRICS:
+            analysis[NATIVE_PREFIX + metric] = self.totals[metric]
+        analysis[NATIVE_PREFIX + 'FILES'] = len(self.files)
+        analysis[NATIVE_PREFIX + 'DIRECTORIES'] = len(self.directories)
+
+    def _add(self, path: str, tree: git.Tree) -> None:
+        """
+        Adds a file to the snapshot, computing its measures only if its blob has never been met before
+
+        :param path: path of the file
+        :param tree: tree of the commit
+        :return: None
+        """
+        if not is_main_java_source(path):
+            return
+        try:
+            blob = tree[path]
+        except KeyError:
+            return
+
+        if blob.hexsha not in self.blob_cache:
+            source = blob.data_stream.read().decode('utf-8', errors='replace')
+            self.blob_cache[blob.hexsha] = java_file_metrics(source)
+
+        self._remove(path)
+        self.files[path] = blob.hexsha
+        self.directories[str(PurePosixPath(path).parent)] += 1
+        for metric in FILE_METRICS:
+            self.totals[metric] += self.blob_cache[blob.hexsha][metric]
+
+    def _remove(self, path: str) -> None:
+        """
+        Removes a file from the snapshot
+
+        :param path: path of the file
+        :return: None
+        """
+        blob_hash = self.files.pop(path, None)
+        if blob_hash is None:
+            return
+
+        directory = str(PurePosixPath(path).parent)
+        self.directories[directory] -= 1
+        if not self.directories[directory]:
+            del self.directories[directory]
+        for metric in FILE_METRICS:
+            self.totals[metric] -= self.blob_cache[blob_hash][metric]
+
+
+def validate_size_metrics(dataset_file: Path) -> dict[str, dict[str, float]]:
+    """
+    Computes the size metrics for all the commits of a dataset produced with SonarQube and compares them with the
+    SonarQube measures, reporting for each metric the number of compared commits, the share of exact matches and the
+    mean absolute percentage error. Only the commits in which SonarQube has measured Java code are compared
+
+    :param dataset_file: CSV file of the dataset
+    :return: dictionary with the results of the comparison for each metric
+    """
+    from pydriller import Repository  # PyDriller
+
+    with open(dataset_file, newline='') as ds_input:
+        rows = {row['COMMIT']: row for row in csv.DictReader(ds_input)}
+    url = next(iter(rows.values()))['REPO']
+    name = url.split('/')[-2] + '.' + url.split('/')[-1]
+    workdir = 'temp/clones/' + name
+
+    errors: dict[str, list[float]] = {metric: [] for metric in SIZE_METRICS}
+    try:
+        print_info('  Cloning repo')
+        git_repo = git.Repo.clone_from(url, workdir)
+        engine = SizeMetricsEngine(git_repo)
+
+        for commit in Repository(workdir).traverse_commits():
+            engine.update(commit)
+            if commit.hash not in rows:
+                continue
+
+            native: dict[str, str | int | None] = {}
+            engine.measures(native)
+            if rows[commit.hash]['CLASSES'] in ('', None):
+                continue  # SonarQube has not measured Java code in this commit
+            for metric in SIZE_METRICS:
+                if rows[commit.hash][metric] in ('', None):
+                    continue  # metric not measured by SonarQube in this commit
+                sonar = float(rows[commit.hash][metric])
+                measure = native[NATIVE_PREFIX + metric]
+                errors[metric].append(abs(measure - sonar) / sonar if sonar else float(measure != 0))
+    finally:
+        print_info('  Clearing temporary directories')
+        clear_repo(Path(workdir))
+
+    results = {}
+    for metric in SIZE_METRICS:
+        if not errors[metric]:
+            print_warning(f'  {metric}: no SonarQube measure to compare with')
+            continue
+        results[metric] = {'commits': len(errors[metric]),
+                           'exact': sum(1 for error in errors[metric] if error == 0) / len(errors[metric]),
+                           'mape': sum(errors[metric]) / len(errors[metric])}
+        print_info(f'  {metric}: {results[metric]["commits"]} commits, {results[metric]["exact"]:.1%} exact, '
+                   f'{results[metric]["mape"]:.1%} mean absolute percentage error')
+    return results
+
+
+if __name__ == "__main__":
+    print_major_step(" Start size metrics validation")
+    start_time = time.time()
+
+    validate_size_metrics(Path(__file__).parent / '../../data/raw/DATASET_mining_output.csv')
+
+    stop_time = time.time()
+    print_progress(f' Total execution time: {str(timedelta(seconds=(stop_time - start_time)))}')
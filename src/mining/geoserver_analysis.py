@@ -1,24 +1,39 @@
 """
 This script performs a commit-by-commit analysis on the Geoserver Cloud repository
-(https://github.com/geoserver/geoserver-cloud). It traverses all the commits of main branch running two analysis: the
-first with the function from Baresi et al. for counting the number of microservices in the code, and the second with
-SonarQube in order to retrieve some metric relatives to code quality/technical debt.
+(https://github.com/geoserver/geoserver-cloud). It traverses (by default) all the commits of main branch running two
+analysis: the first with the function from Baresi et al. for counting the number of microservices in the code, and the
+second with SonarQube in order to retrieve some metric relatives to code quality/technical debt.
+
+With the --quick-scan option SonarQube is not used and only the size metrics are computed, with the native engine of
+code_metrics module, in order to trace the size trends along the whole history in minutes.
+
+With the --stride and/or --window options only a sample of the commits is analyzed: a coarse pass is refined by
+bisecting the intervals where the number of microservices or the technical debt change, and the other commits are
+interpolated (see sampling module).
+
+The analyzed repository and the commits to analyze (date and commit/tag ranges, branch, paths) can be selected with
+the command line options (run with --help), which can also be read from a file passed as @FILE.
 """
 
+import argparse
 import csv
 import logging
 import re
 import time
-from datetime import timedelta
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Any, Optional
 
 import git  # GitPython
-from pydriller import Repository  # PyDriller
+from pydriller import Commit  # PyDriller
 
+from code_metrics import NATIVE_SIZE_METRICS, SizeMetricsEngine
 from microservices_analysis import analyze_docker_compose, locate_files
 from print_utils import print_progress, print_major_step, print_minor_step, print_info, block_print, restore_print
-from repo import clear_repo
+from repo import clear_repo, list_commits
+from sampling import REFINEMENT_THRESHOLDS, SAMPLED, interpolate, sample_history
 from sonarqube import sq_start_up, sq_shut_down, sq_post, sq_measure, sq_scanner_geoserver, sq_wait_ce
+from supervisor import BACKOFF, RETRIES, STAGE_DEADLINES, RetryQueue, StageTimeout, run_with_deadline
 
 SQ_METRICS = ["COMPLEXITY", "COGNITIVE_COMPLEXITY",  # complexity
               "VIOLATIONS",  # issues
@@ -31,20 +46,44 @@ SQ_METRICS = ["COMPLEXITY", "COGNITIVE_COMPLEXITY",  # complexity
               "LINES", "NCLOC", "FUNCTIONS", "STATEMENTS"
               ]
 
-DS_KEYS = ["REPO", "COMMIT",  # identifier
-           "AUTHOR_NAME", "AUTHOR_EMAIL", "AUTHOR_DATE", "AUTHORS",  # author info
-           "COMMITTER_NAME", "COMMITTER_EMAIL", "COMMITTER_DATE", "COMMITTERS",  # committer info
-           "MICROSERVICES"  # microservices
-           ] + SQ_METRICS
+COMMIT_KEYS = ["REPO", "COMMIT",  # identifier
+               "AUTHOR_NAME", "AUTHOR_EMAIL", "AUTHOR_DATE", "AUTHORS",  # author info
+               "COMMITTER_NAME", "COMMITTER_EMAIL", "COMMITTER_DATE", "COMMITTERS",  # committer info
+               "MICROSERVICES"  # microservices
+               ]
+
+RUN_KEYS = ["SAMPLING",  # SAMPLED if the commit has been analyzed, INTERPOLATED otherwise
+            "FAILURE"]  # reasons of the failure of the analysis, if any
 
+DS_KEYS = COMMIT_KEYS + SQ_METRICS + RUN_KEYS
 
-def analyze_repo(url: str, repo_writer: csv.DictWriter, recurse: bool = False) -> None:
+QS_KEYS = COMMIT_KEYS + NATIVE_SIZE_METRICS + RUN_KEYS  # dataset of the quick scan
+
+
+def analyze_repo(url: str, repo_writer: csv.DictWriter, recurse: bool = False, quick_scan: bool = False,
+                 stride: Optional[int] = None, window: Optional[timedelta] = None,
+                 thresholds: Optional[dict[str, float]] = None, budget: Optional[int] = None,
+                 retries: int = RETRIES, backoff: float = BACKOFF,
+                 selection: Optional[dict[str, Any]] = None) -> None:
     """
-    Run the analysis of a single repo
+    Run the analysis of a single repo. If a stride or a time window is given, the history is analyzed with the adaptive
+    sampling (see sampling module), otherwise all the commits are analyzed. The commits whose analysis fails, times out
+    or raises an error are retried at the end (see supervisor module). In the full analysis each row is saved in a
+    checkpoint file as soon as its commit is analyzed, then the rows are written in commit order, with the ones of the
+    retried commits replaced, after the retries or as soon as the analysis is interrupted
 
     :param url: url of the repository
     :param repo_writer: CSV writer to write the results of analysis at dataset level
     :param recurse: if True the cloning recurse on the submodules
+    :param quick_scan: if True the size metrics are computed natively instead of running the SonarQube analysis
+    :param stride: number of commits between two commits analyzed in the coarse pass of the sampling
+    :param window: duration of the time windows of the coarse pass of the sampling
+    :param thresholds: threshold of the changes of each metric driving the refinement of the sampling
+    :param budget: maximum number of commits analyzed with the sampling
+    :param retries: number of retry rounds of the failed commits
+    :param backoff: seconds to wait before the first retry round, doubled at each round
+    :param selection: filters selecting the commits to analyze (see list_commits), by default all the commits reachable
+    from HEAD
     :return: None
     """
     name = url.split('/')[-2] + '.' + url.split('/')[-1]
@@ -53,48 +92,136 @@ def analyze_repo(url: str, repo_writer: csv.DictWriter, recurse: bool = False) -
 
     try:
         print_info('  Cloning repo and creating SQ project')
-        repository = Repository(url + ".git")  # Pydriller: useful to traverse commits history
         git_repo = git.Repo.clone_from(url, workdir)  # GitPython: useful to work with repo (git show, shortlog...)
 
-        sq_post('api/projects/create', {'name': name, 'project': name})
-
-        print_info('  Counting commits')
-        num_of_commits = len(list(repository.traverse_commits()))
-
-        count = 0
-        for commit in repository.traverse_commits():  # Apparently traverse_commits traverses only main branch commits
-            count += 1
-            print_minor_step(f'  Start commit analysis ({count}/{num_of_commits}) [{commit.hash}]')
-
-            git_repo.git.checkout(commit.hash, force=True)
-
-            if recurse:
-                gitmodules_file = Path(__file__).parent.joinpath(f'temp/clones/{name}/.gitmodules')
-                if gitmodules_file.exists():
-                    # To avoid cloning through ssh, which require authentication, all modules are updated so they can be
-                    # cloned through https
-                    with open(gitmodules_file, 'r') as gitmodules:
-                        gitmodules_content = gitmodules.read()
-                    gitmodules_content = re.sub("git@github.com:", "https://github.com/", gitmodules_content)
-                    with open(gitmodules_file, 'w') as gitmodules:
-                        gitmodules.write(gitmodules_content)
-
+        size_engine = SizeMetricsEngine(git_repo) if quick_scan else None
+        metrics = ['MICROSERVICES'] + (NATIVE_SIZE_METRICS if quick_scan else SQ_METRICS)
+        if not quick_scan:
+            sq_post('api/projects/create', {'name': name, 'project': name})
+
+        print_info('  Selecting commits')
+        commits = list_commits(workdir, **(selection or {}))  # Pydriller: useful to traverse commits history
+        num_of_commits = len(commits)
+
+        retry_queue = RetryQueue(retries, backoff)
+
+        def attempt(index: int) -> dict[str, str | int | None]:
+            try:
+                return analyze_commit(url, name, workdir, git_repo, commits[index], recurse, size_engine)
+            except Exception as e_commit:
+                logging.error(f'Error analyzing commit {commits[index].hash}', exc_info=e_commit)
+                return fail_commit(url, git_repo, commits[index].hash, f'error: {e_commit}')
+
+        def analyze(index: int) -> dict[str, str | int | None]:
+            repo_analysis = attempt(index)
+            if repo_analysis['FAILURE'] is not None:
+                retry_queue.push(index, repo_analysis['FAILURE'])
+            return repo_analysis
+
+        def retry(index: int) -> dict[str, str | int | None]:
+            print_minor_step(f'  Retry commit analysis ({index + 1}/{num_of_commits}) [{commits[index].hash}]')
+            return attempt(index)
+
+        def describe(index: int) -> dict[str, str | int | None]:
+            return describe_commit(url, git_repo, commits[index].hash)
+
+        if stride is None and window is None:
+            checkpoint_file = Path(workdir).parent.parent / f'{name}.checkpoint.csv'
+            with open(checkpoint_file, 'w+', newline='') as checkpoint:
+                checkpoint_writer = csv.DictWriter(checkpoint, repo_writer.fieldnames)
+                retried = {}
                 try:
-                    git_repo.git.execute(['git', 'submodule', 'update', '--init', '--recursive'])
-                except Exception as e_submodules:
-                    logging.error('Error updating submodules', exc_info=e_submodules)
+                    for index, commit in enumerate(commits):
+                        print_minor_step(f'  Start commit analysis ({index + 1}/{num_of_commits}) [{commit.hash}]')
+                        checkpoint_writer.writerow(analyze(index))
+                        checkpoint.flush()
+
+                    retried = retry_queue.process(retry)
+                finally:
+                    print_info('  Writing data')
+                    checkpoint.seek(0)
+                    written = failed = 0
+                    for index, row in enumerate(csv.DictReader(checkpoint, repo_writer.fieldnames)):
+                        row = retried.get(index, row)
+                        written += 1
+                        failed += bool(row['FAILURE'])
+                        repo_writer.writerow(row)
+                    print_info(f'  {written}/{num_of_commits} commits written ({failed} failed)')
+            checkpoint_file.unlink()
+        else:
+            print_info('  Sampling commits')
+            rows = sample_history(commits, analyze, describe, metrics,
+                                  stride, window, thresholds, budget)
+
+            retried = retry_queue.process(retry)
+            if retried:
+                sampled = {index: row for index, row in enumerate(rows) if row['SAMPLING'] == SAMPLED}
+                sampled.update(retried)
+                rows = interpolate(sampled, describe, metrics)
+
+            print_info(f'  Writing data ({sum(row["SAMPLING"] == SAMPLED for row in rows)}/{num_of_commits} commits '
+                       f'analyzed)')
+            repo_writer.writerows(rows)
+    except Exception:
+        raise
+    finally:
+        print_info('  Clearing temporary directories')
+        clear_repo(Path(workdir))
 
-            repo_analysis: dict[str, str | int | None] = dict.fromkeys(DS_KEYS)
 
-            repo_analysis['REPO'] = url
-            repo_analysis['COMMIT'] = commit.hash
+def analyze_commit(url: str, name: str, workdir: str, git_repo: git.Repo, commit: Commit, recurse: bool,
+                   size_engine: Optional[SizeMetricsEngine]) -> dict[str, str | int | None]:
+    """
+    Run the analysis of a single commit
 
-            print_info('  Analyzing Git history')
-            recover_git_infos(git_repo, commit.hash, repo_analysis)
+    :param url: url of the repository
+    :param name: name of the repository (and key of the SQ project)
+    :param workdir: directory of the repository
+    :param git_repo: Git repository
+    :param commit: PyDriller commit
+    :param recurse: if True the cloning recurse on the submodules
+    :param size_engine: engine computing the size metrics natively, if None the SonarQube analysis is performed
+    :return: dictionary with the information about the commit, with the reasons of the failures (if any) in FAILURE
+    """
+    failures = []
+
+    git_repo.git.checkout(commit.hash, force=True)
 
-            print_info('  Analyzing microservices')
-            compute_microservice_metric(workdir, repo_analysis)
+    if recurse:
+        gitmodules_file = Path(__file__).parent.joinpath(f'temp/clones/{name}/.gitmodules')
+        if gitmodules_file.exists():
+            # To avoid cloning through ssh, which require authentication, all modules are updated so they can be
+            # cloned through https
+            with open(gitmodules_file, 'r') as gitmodules:
+                gitmodules_content = gitmodules.read()
+            gitmodules_content = re.sub("git@github.com:", "https://github.com/", gitmodules_content)
+            with open(gitmodules_file, 'w') as gitmodules:
+                gitmodules.write(gitmodules_content)
 
+        try:
+            submodules = run_with_deadline('submodules', ['git', 'submodule', 'update', '--init', '--recursive'],
+                                           cwd=Path(workdir))
+            if submodules.returncode != 0:
+                logging.error('Error updating submodules')
+                failures.append('submodules failed')
+        except StageTimeout as e_submodules:
+            failures.append(str(e_submodules))
+        except Exception as e_submodules:
+            logging.error('Error updating submodules', exc_info=e_submodules)
+
+    print_info('  Analyzing Git history')
+    repo_analysis = describe_commit(url, git_repo, commit.hash)
+    repo_analysis['SAMPLING'] = SAMPLED
+
+    print_info('  Analyzing microservices')
+    compute_microservice_metric(workdir, repo_analysis)
+
+    if size_engine is not None:
+        print_info('  Computing size metrics')
+        size_engine.update(commit)
+        size_engine.measures(repo_analysis)
+    else:
+        try:
             print_info('  Analyzing SonarQube code quality')
             mvn_success = sq_scanner_geoserver(name)
 
@@ -102,14 +229,56 @@ def analyze_repo(url: str, repo_writer: csv.DictWriter, recurse: bool = False) -
                 print_info('  Waiting results\' availability and retrieving metrics\' measures')
                 if sq_wait_ce(name):
                     retrieve_sq_metrics(name, repo_analysis)
+                else:
+                    failures.append('CE task failed')
+            else:
+                failures.append('build failed')
+        except StageTimeout as e_stage:
+            failures.append(str(e_stage))
 
-            print_info('  Writing data')
-            repo_writer.writerow(repo_analysis)
-    except Exception:
-        raise
-    finally:
-        print_info('  Clearing temporary directories')
-        clear_repo(Path(workdir))
+    repo_analysis['FAILURE'] = '; '.join(failures) if failures else None
+    return repo_analysis
+
+
+def fail_commit(url: str, git_repo: git.Repo, commit_hash: str, reason: str) -> dict[str, str | int | None]:
+    """
+    Creates the dictionary of the information about a commit whose analysis raised an error
+
+    :param url: url of the repository
+    :param git_repo: Git repository
+    :param commit_hash: Commit
+    :param reason: reason of the failure
+    :return: dictionary with the information about the commit (only the identifiers if the Git information cannot be
+    recovered), with the reason of the failure in FAILURE
+    """
+    try:
+        repo_analysis = describe_commit(url, git_repo, commit_hash)
+    except Exception as e_describe:
+        logging.error(f'Error describing commit {commit_hash}', exc_info=e_describe)
+        repo_analysis = dict.fromkeys(COMMIT_KEYS + RUN_KEYS)
+        repo_analysis['REPO'] = url
+        repo_analysis['COMMIT'] = commit_hash
+    repo_analysis['SAMPLING'] = SAMPLED
+    repo_analysis['FAILURE'] = reason
+    return repo_analysis
+
+
+def describe_commit(url: str, git_repo: git.Repo, commit_hash: str) -> dict[str, str | int | None]:
+    """
+    Creates the dictionary of the information about a commit, filled with its identifiers and Git information
+
+    :param url: url of the repository
+    :param git_repo: Git repository
+    :param commit_hash: Commit
+    :return: dictionary with the information about the commit
+    """
+    repo_analysis: dict[str, str | int | None] = dict.fromkeys(COMMIT_KEYS + RUN_KEYS)
+
+    repo_analysis['REPO'] = url
+    repo_analysis['COMMIT'] = commit_hash
+
+    recover_git_infos(git_repo, commit_hash, repo_analysis)
+    return repo_analysis
 
 
 def compute_microservice_metric(workdir: str, analysis: dict[str, str | int | None]) -> None:
@@ -161,31 +330,105 @@ def recover_git_infos(git_repo: git.Repo, commit_hash: str, analysis: dict[str,
     analysis['COMMITTER_NAME'] = git_repo.git.execute(["git", "show", "-s", "--format='%cn'", commit_hash])[1:-1]
     analysis['COMMITTER_EMAIL'] = git_repo.git.execute(["git", "show", "-s", "--format='%ce'", commit_hash])[1:-1]
     analysis['COMMITTER_DATE'] = git_repo.git.execute(["git", "show", "-s", "--format='%cs'", commit_hash])[1:-1]
-    analysis['AUTHORS'] = len(git_repo.git.execute(["git", "shortlog", "HEAD", "-s"]).splitlines())
-    analysis['COMMITTERS'] = len(git_repo.git.execute(["git", "shortlog", "HEAD", "-s", "-c"]).splitlines())
+    analysis['AUTHORS'] = len(git_repo.git.execute(["git", "shortlog", commit_hash, "-s"]).splitlines())
+    analysis['COMMITTERS'] = len(git_repo.git.execute(["git", "shortlog", commit_hash, "-s", "-c"]).splitlines())
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Commit-by-commit analysis of Geoserver Cloud repository',
+                                     fromfile_prefix_chars='@')
+    parser.add_argument('--url', default='https://github.com/geoserver/geoserver-cloud',
+                        help='url of the repository to analyze (default Geoserver Cloud)')
+    parser.add_argument('--output', type=Path,
+                        help='CSV file where to write the dataset (default in data/raw folder)')
+    parser.add_argument('--append', action='store_true',
+                        help='append the results to the output file instead of overwriting it')
+    parser.add_argument('--recurse', action='store_true',
+                        help='update the submodules of the repository at each commit')
+    parser.add_argument('--since', type=datetime.fromisoformat, metavar='DATE',
+                        help='analyze only commits more recent than DATE (ISO format)')
+    parser.add_argument('--until', type=datetime.fromisoformat, metavar='DATE',
+                        help='analyze only commits older than DATE (ISO format)')
+    parser.add_argument('--from-commit', '--from-tag', dest='from_commit', metavar='REV',
+                        help='analyze only commits descending from REV (commit or tag, included)')
+    head = parser.add_mutually_exclusive_group()
+    head.add_argument('--to-commit', '--to-tag', dest='to_commit', metavar='REV',
+                      help='analyze only commits from which REV (commit or tag, included) descends')
+    head.add_argument('--branch',
+                      help='analyze only commits of BRANCH (default the checked out one)')
+    parser.add_argument('--path', action='append', dest='paths',
+                        help='analyze only commits modifying PATH (can be repeated)')
+    parser.add_argument('--quick-scan', action='store_true',
+                        help='compute only the size metrics with the native engine, without SonarQube')
+    parser.add_argument('--stride', type=int,
+                        help='sample the history analyzing one commit every STRIDE in the coarse pass')
+    parser.add_argument('--window', type=int, metavar='DAYS',
+                        help='sample the history analyzing one commit every DAYS days in the coarse pass')
+    parser.add_argument('--ms-threshold', type=float, default=REFINEMENT_THRESHOLDS['MICROSERVICES'],
+                        help='change of MICROSERVICES above which an interval of the sampling is refined '
+                             f'(default {REFINEMENT_THRESHOLDS["MICROSERVICES"]})')
+    parser.add_argument('--sqale-threshold', type=float, default=REFINEMENT_THRESHOLDS['SQALE_INDEX'],
+                        help='change of SQALE_INDEX (in minutes) above which an interval of the sampling is refined '
+                             f'(default {REFINEMENT_THRESHOLDS["SQALE_INDEX"]})')
+    parser.add_argument('--budget', type=int,
+                        help='maximum number of commits analyzed with the sampling, coarse pass included')
+    for stage, deadline in STAGE_DEADLINES.items():
+        parser.add_argument(f'--{stage}-deadline', type=float, default=deadline, metavar='SECONDS',
+                            help=f'deadline of the {stage} stage (default {deadline}s)')
+    parser.add_argument('--retries', type=int, default=RETRIES,
+                        help=f'number of retry rounds of the failed commits (default {RETRIES})')
+    parser.add_argument('--backoff', type=float, default=BACKOFF, metavar='SECONDS',
+                        help=f'wait before the first retry round, doubled at each round (default {BACKOFF}s)')
+    args = parser.parse_args()
+
+    for stage in STAGE_DEADLINES:
+        STAGE_DEADLINES[stage] = getattr(args, f'{stage}_deadline')
+
+    if args.output is not None:
+        output_file = args.output
+    elif args.quick_scan:
+        output_file = Path(__file__).parent / '../../data/raw/DATASET_quick_scan_output.csv'
+    else:
+        output_file = Path(__file__).parent / '../../data/raw/DATASET_mining_output.csv'
+    ds_keys = QS_KEYS if args.quick_scan else DS_KEYS
+    append = args.append and output_file.exists() and output_file.stat().st_size > 0
+
+    if append:
+        # Datasets written by previous versions of the script could have different columns
+        with open(output_file, newline='') as ds_input:
+            header = next(csv.reader(ds_input), [])
+        if header != ds_keys:
+            parser.error(f'cannot append to {output_file}: its columns differ from the ones of the dataset '
+                         f'(missing: {[key for key in ds_keys if key not in header]}, '
+                         f'unexpected: {[key for key in header if key not in ds_keys]})')
+
     print_major_step(" Start script execution")
     start_time = time.time()
 
-    print_info(' Starting up SonarQube server')
-    sq_start_up()
-
     try:
-        print_info(' Performing analysis')
-        output_file = Path(__file__).parent / '../data/raw/DATASET_mining_output.csv'
-
-        with open(output_file, 'w+', newline='') as ds_output:
-            writer = csv.DictWriter(ds_output, DS_KEYS)
-            writer.writeheader()
+        if not args.quick_scan:
+            print_info(' Starting up SonarQube server')
+            sq_start_up()
 
-            analyze_repo('https://github.com/geoserver/geoserver-cloud', writer)
+        print_info(' Performing analysis')
+        with open(output_file, 'a' if append else 'w+', newline='') as ds_output:
+            writer = csv.DictWriter(ds_output, ds_keys)
+            if not append:
+                writer.writeheader()
+
+            analyze_repo(args.url, writer, recurse=args.recurse, quick_scan=args.quick_scan,
+                         stride=args.stride,
+                         window=timedelta(days=args.window) if args.window is not None else None,
+                         thresholds={'MICROSERVICES': args.ms_threshold, 'SQALE_INDEX': args.sqale_threshold},
+                         budget=args.budget, retries=args.retries, backoff=args.backoff,
+                         selection={'since': args.since, 'until': args.until, 'from_commit': args.from_commit,
+                                    'to_commit': args.to_commit, 'branch': args.branch, 'paths': args.paths})
     except Exception as e:
         logging.error("Unexpected error", exc_info=e)
     finally:
-        print_info(' Shutting down SonarQube server')
-        sq_shut_down()
+        if not args.quick_scan:
+            print_info(' Shutting down SonarQube server')
+            sq_shut_down()
 
     print_info(' Terminating script execution')
     stop_time = time.time()
@@ -1,6 +1,12 @@
 import os
 import shutil
+from datetime import datetime
 from pathlib import Path
+from typing import Optional
+
+import git  # GitPython
+from pydriller import Commit, Git  # PyDriller
+
 from print_utils import print_warning
 
 
@@ -22,3 +28,49 @@ def clear_repo(path: Path) -> None:
 
     except Exception as e:
         print_warning(f'-failed to delete {path}. Reason: {e}')
+
+
+def list_commits(workdir: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 from_commit: Optional[str] = None, to_commit: Optional[str] = None, branch: Optional[str] = None,
+                 paths: Optional[list[str]] = None) -> list[Commit]:
+    """
+    Lists, in chronological order, the commits of a repository selected by the given filters. The filters are passed
+    to git rev-list, so the excluded commits are never materialized
+
+    :param workdir: directory of the repository
+    :param since: only commits more recent than this date
+    :param until: only commits older than this date
+    :param from_commit: only commits descending from this commit or tag (included)
+    :param to_commit: only commits from which this commit or tag (included) descends
+    :param branch: only commits of this branch (alternative to to_commit)
+    :param paths: only commits modifying these paths
+    :return: the PyDriller commits
+    :raise ValueError: if both to_commit and branch are given
+    :raise RuntimeError: if from_commit is given and Git is older than 2.38 (required for --ancestry-path=<commit>)
+    """
+    if to_commit is not None and branch is not None:
+        raise ValueError('to_commit and branch filters are alternative')
+
+    git_repo = git.Repo(workdir)
+
+    if to_commit is not None:
+        rev = [to_commit]
+    elif branch is not None:
+        # Only the default branch is local in a fresh clone, the others are remote-tracking
+        rev = [branch if branch in git_repo.heads else f'origin/{branch}']
+    else:
+        rev = ['HEAD']
+    if from_commit is not None:
+        if git_repo.git.version_info < (2, 38):
+            raise RuntimeError(f'from_commit filter requires Git 2.38 or newer (found '
+                               f'{".".join(map(str, git_repo.git.version_info))})')
+        start = git_repo.commit(from_commit)
+        rev += [f'--ancestry-path={start.hexsha}'] + ['^' + parent.hexsha for parent in start.parents]
+
+    kwargs = {}
+    if since is not None:
+        kwargs['since'] = since.isoformat()
+    if until is not None:
+        kwargs['until'] = until.isoformat()
+
+    return list(Git(workdir).get_list_commits(rev, paths=paths or '', **kwargs))
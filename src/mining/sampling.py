@@ -0,0 +1,251 @@
+"""
+This module implements the adaptive sampling of the commits history. The history is first analyzed with a coarse
+stride (every N commits or a commit per time window), then the intervals between two analyzed commits in which the
+monitored metrics change more than a threshold are recursively bisected, until the changes are localized to single
+commits or the budget of analyses is spent. The commits that are not analyzed are interpolated. The commits whose
+analysis failed are skipped: the changes and the interpolations are computed between the closest successful analyses.
+"""
+
+import heapq
+from datetime import timedelta
+from typing import Any, Callable, Optional
+
+from print_utils import print_minor_step
+
+SAMPLED = 'SAMPLED'
+INTERPOLATED = 'INTERPOLATED'
+
+# Metrics whose changes drive the refinement, with the default threshold. SQALE_INDEX (in minutes) changes at almost
+# every commit, so only the changes above a day of technical debt (8 hours, as in SonarQube) are refined
+REFINEMENT_THRESHOLDS = {'MICROSERVICES': 0, 'SQALE_INDEX': 480}
+
+# Metrics that cannot be linearly interpolated (quality gate status and A-E ratings), carried forward instead
+CATEGORICAL_METRICS = {'ALERT_STATUS', 'SQALE_RATING', 'RELIABILITY_RATING', 'SECURITY_RATING'}
+
+
+def coarse_sample(commits: list, stride: Optional[int] = None, window: Optional[timedelta] = None,
+                  budget: Optional[int] = None) -> list[int]:
+    """
+    Selects the commits of the coarse pass: one every stride commits or the first commit of each time window. The first
+    and the last commit are always selected. If the selected commits exceed the budget, they are evenly thinned out
+
+    :param commits: PyDriller commits, in chronological order
+    :param stride: number of commits between two selected commits
+    :param window: duration of the time window
+    :param budget: maximum number of selected commits (at least 2, the first and the last commit)
+    :return: indexes of the selected commits
+    """
+    if not commits:
+        return []
+
+    selected = {0, len(commits) - 1}
+    if stride is not None:
+        selected.update(range(0, len(commits), stride))
+    if window is not None:
+        window_start = commits[0].committer_date
+        for index, commit in enumerate(commits):
+            if commit.committer_date - window_start >= window:
+                selected.add(index)
+                window_start = commit.committer_date
+
+    selected = sorted(selected)
+    if budget is not None and len(selected) > max(budget, 2):
+        step = (len(selected) - 1) / (max(budget, 2) - 1)
+        selected = [selected[round(position * step)] for position in range(max(budget, 2))]
+    return selected
+
+
+def metrics_change(before: dict[str, Any], after: dict[str, Any], thresholds: dict[str, float]) -> float:
+    """
+    Measures how much the monitored metrics change between two analyzed commits, as the largest ratio between the
+    change of a metric and its threshold
+
+    :param before: analysis of the first commit
+    :param after: analysis of the second commit
+    :param thresholds: threshold of each monitored metric
+    :return: magnitude of the change, greater than 1 if at least a metric changes more than its threshold
+    """
+    change = 0.0
+    for metric, threshold in thresholds.items():
+        value_before = to_number(before.get(metric))
+        value_after = to_number(after.get(metric))
+        if value_before is None and value_after is None:
+            continue
+        if value_before is None or value_after is None:
+            return float('inf')  # the metric has been measured only in one of the commits
+        delta = abs(value_after - value_before)
+        if delta > threshold:
+            change = max(change, delta / threshold if threshold else float('inf'))
+    return change
+
+
+def sample_history(commits: list,
+                   analyze: Callable[[int], dict[str, Any]],
+                   describe: Callable[[int], dict[str, Any]],
+                   metrics: list[str],
+                   stride: Optional[int] = None,
+                   window: Optional[timedelta] = None,
+                   thresholds: Optional[dict[str, float]] = None,
+                   budget: Optional[int] = None) -> list[dict[str, Any]]:
+    """
+    Analyzes the history with the adaptive sampling. The intervals with the largest changes are bisected first, so that
+    if the budget is spent the remaining uncertainty is on the smallest changes
+
+    :param commits: PyDriller commits, in chronological order
+    :param analyze: function performing the full analysis of the commit at the given index
+    :param describe: function returning the identifiers and the Git information of the commit at the given index,
+    used for the interpolated commits
+    :param metrics: metrics to interpolate
+    :param stride: number of commits between two commits of the coarse pass
+    :param window: duration of the time windows of the coarse pass
+    :param thresholds: threshold of each metric driving the refinement (default REFINEMENT_THRESHOLDS)
+    :param budget: maximum number of analyzed commits, coarse pass included (default unlimited)
+    :return: the rows of all the commits, with the SAMPLING column set to SAMPLED or INTERPOLATED
+    """
+    if thresholds is None:
+        thresholds = REFINEMENT_THRESHOLDS
+
+    sampled: dict[int, dict[str, Any]] = {}
+
+    def analyze_sample(index: int) -> None:
+        print_minor_step(f'  Start commit analysis ({len(sampled) + 1}, {index + 1}/{len(commits)}) '
+                         f'[{commits[index].hash}]')
+        sampled[index] = analyze(index)
+        sampled[index]['SAMPLING'] = SAMPLED
+
+    coarse = coarse_sample(commits, stride, window, budget)
+    for index in coarse:
+        analyze_sample(index)
+
+    intervals = []  # heap of the intervals to refine, ordered by decreasing change
+    for start, end in zip(coarse, coarse[1:]):
+        push_interval(intervals, sampled, start, end, thresholds)
+
+    while intervals and (budget is None or len(sampled) < budget):
+        _, start, end = heapq.heappop(intervals)
+        middle = (start + end) // 2
+        analyze_sample(middle)
+        push_interval(intervals, sampled, start, middle, thresholds)
+        push_interval(intervals, sampled, middle, end, thresholds)
+
+    return interpolate(sampled, describe, metrics)
+
+
+def push_interval(intervals: list, sampled: dict[int, dict[str, Any]], start: int, end: int,
+                  thresholds: dict[str, float]) -> None:
+    """
+    Pushes an interval in the heap of the intervals to refine if it contains commits not analyzed and the metrics
+    change more than the thresholds between its ends. If an end failed, the closest successful analysis beyond it is
+    used instead, and the intervals whose ends both failed are not refined (the change cannot be localized inside them)
+
+    :param intervals: heap of the intervals
+    :param sampled: analyzed commits by index
+    :param start: index of the first commit of the interval
+    :param end: index of the last commit of the interval
+    :param thresholds: threshold of each monitored metric
+    :return: None
+    """
+    if end - start < 2 or (is_failed(sampled[start]) and is_failed(sampled[end])):
+        return
+    before = closest_success(sampled, start, -1)
+    after = closest_success(sampled, end, 1)
+    if before is None or after is None:
+        return
+    change = metrics_change(sampled[before], sampled[after], thresholds)
+    if change > 1:
+        heapq.heappush(intervals, (-change, start, end))
+
+
+def interpolate(sampled: dict[int, dict[str, Any]], describe: Callable[[int], dict[str, Any]],
+                metrics: list[str]) -> list[dict[str, Any]]:
+    """
+    Builds the rows of all the commits, interpolating the metrics of the commits not analyzed between the two closest
+    successfully analyzed commits: numeric metrics are linearly interpolated, categorical ones are carried forward. If
+    there is no successful analysis on one side, the metrics are left empty
+
+    :param sampled: analyzed commits by index (the first and the last commit must be included)
+    :param describe: function returning the identifiers and the Git information of the commit at the given index
+    :param metrics: metrics to interpolate
+    :return: the rows of all the commits
+    """
+    rows = []
+    indexes = sorted(sampled)
+    for start, end in zip(indexes, indexes[1:]):
+        rows.append(sampled[start])
+        before = closest_success(sampled, start, -1)
+        after = closest_success(sampled, end, 1)
+        for index in range(start + 1, end):
+            row = describe(index)
+            for metric in metrics:
+                if before is None or after is None:
+                    row[metric] = None
+                else:
+                    row[metric] = interpolate_value(metric, sampled[before].get(metric), sampled[after].get(metric),
+                                                    (index - before) / (after - before))
+            row['SAMPLING'] = INTERPOLATED
+            rows.append(row)
+    if indexes:
+        rows.append(sampled[indexes[-1]])
+    return rows
+
+
+def interpolate_value(metric: str, before: Any, after: Any, position: float) -> Any:
+    """
+    Interpolates a value between two measures
+
+    :param metric: name of the metric
+    :param before: measure of the previous analyzed commit
+    :param after: measure of the next analyzed commit
+    :param position: relative position of the commit between the two analyzed commits (from 0 to 1)
+    :return: the interpolated value, None if a numeric measure is missing
+    """
+    if metric in CATEGORICAL_METRICS:
+        return before
+    number_before = to_number(before)
+    number_after = to_number(after)
+    if number_before is None or number_after is None:
+        return None
+
+    value = number_before + (number_after - number_before) * position
+    if float(number_before).is_integer() and float(number_after).is_integer() and '.' not in f'{before}{after}':
+        return round(value)
+    return round(value, 1)
+
+
+def is_failed(row: dict[str, Any]) -> bool:
+    """
+    Checks if the analysis of a commit failed
+
+    :param row: analysis of the commit
+    :return: True if the FAILURE column is set, False otherwise
+    """
+    return row.get('FAILURE') is not None
+
+
+def closest_success(sampled: dict[int, dict[str, Any]], index: int, direction: int) -> Optional[int]:
+    """
+    Finds the closest successfully analyzed commit starting from an analyzed commit
+
+    :param sampled: analyzed commits by index
+    :param index: index of the analyzed commit to start from (returned if its analysis succeeded)
+    :param direction: -1 to search backwards, 1 to search forwards
+    :return: index of the closest successful analysis or None if there is none in that direction
+    """
+    indexes = sorted((other for other in sampled if (other - index) * direction >= 0),
+                     key=lambda other: abs(other - index))
+    return next((other for other in indexes if not is_failed(sampled[other])), None)
+
+
+def to_number(value: Any) -> Optional[float]:
+    """
+    Converts a measure to a number
+
+    :param value: measure (as returned by SonarQube API or computed by the script)
+    :return: the number or None if the measure is missing or not numeric
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
@@ -10,11 +10,14 @@ import requests
 from print_utils import print_appendable
 from requests import RequestException
 from requests.auth import HTTPBasicAuth
+from supervisor import (STAGE_DEADLINES, StageTimeout, deadline_expired, kill_process_group, run_with_deadline,
+                        time_left)
 
 SQ_USER = 'admin'
 SQ_PASSWORD = 'admin'  # FIXME change pw
 SQ_TOKEN = ''
 SQ_TOKEN_NAME = 'mining_script'  # FIXME change token name
+SQ_REQUEST_TIMEOUT = 60  # seconds to wait for a response of the server
 
 
 def sq_start_up() -> None:
@@ -22,16 +25,24 @@ def sq_start_up() -> None:
     Starts SonarQube server with Docker compose and creates an user token
 
     :return: None
+    :raise StageTimeout: if the server is not operational within the deadline of the start-up (the whole Docker
+    compose process group is killed)
     """
     cmd = ['docker', 'compose', 'up']
-    subprocess.Popen(cmd, cwd=Path(__file__).parent, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    compose = subprocess.Popen(cmd, cwd=Path(__file__).parent, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
 
     print_appendable('Starting Docker container')
+    start_time = time.monotonic()
     while True:
         time.sleep(5)
+        if deadline_expired('startup', start_time):
+            print(' SonarQube is not operational')
+            kill_process_group(compose)
+            raise StageTimeout('startup', STAGE_DEADLINES['startup'])
         try:
             print_appendable('.')
-            response = sq_get('api/system/status')
+            response = sq_get('api/system/status', timeout=time_left('startup', start_time, SQ_REQUEST_TIMEOUT))
             if response['status'] == 'UP':
                 print(' SonarQube is operational')
                 break
@@ -49,7 +60,10 @@ def sq_shut_down(remove: bool = False) -> None:
     :param remove: if True it removes the containers
     :return: None
     """
-    sq_post('api/user_tokens/revoke', {'name': SQ_TOKEN_NAME})
+    try:
+        sq_post('api/user_tokens/revoke', {'name': SQ_TOKEN_NAME})
+    except RequestException as e:
+        logging.error("Error revoking user token", exc_info=e)
     global SQ_TOKEN
     SQ_TOKEN = None
 
@@ -70,12 +84,13 @@ def sq_token() -> str:
     return SQ_TOKEN
 
 
-def sq_get(url: str, params: dict[str, str] = None) -> Any:
+def sq_get(url: str, params: dict[str, str] = None, timeout: Optional[float] = SQ_REQUEST_TIMEOUT) -> Any:
     """
     Performs a get request to SonarQube server through Web API
 
     :param url: API
     :param params: parameters
+    :param timeout: seconds to wait for the response
     :return: response
     """
     if params is None:
@@ -83,22 +98,25 @@ def sq_get(url: str, params: dict[str, str] = None) -> Any:
     response = requests.get('http://localhost:9000/' + url,
                             auth=HTTPBasicAuth(username=SQ_USER, password=SQ_PASSWORD),
                             verify=False,
-                            params=params)
+                            params=params,
+                            timeout=timeout)
     return response.json()
 
 
-def sq_post(url: str, params: dict[str, str]) -> Any:
+def sq_post(url: str, params: dict[str, str], timeout: Optional[float] = SQ_REQUEST_TIMEOUT) -> Any:
     """
     Performs a post request to SonarQube server through Web API
 
     :param url: API
     :param params: parameters
+    :param timeout: seconds to wait for the response
     :return: response
     """
     response = requests.post('http://localhost:9000/' + url,
                              auth=HTTPBasicAuth(username=SQ_USER, password=SQ_PASSWORD),
                              verify=False,
-                             params=params)
+                             params=params,
+                             timeout=timeout)
     try:
         return response.json()
     except JSONDecodeError:
@@ -114,6 +132,7 @@ def sq_scanner_geoserver(project: str, verbose: bool = False) -> bool:
 
     :return: True if the build succeed, False otherwise. N.B. if verbose=True, the detection of build success could be
     less accurate
+    :raise StageTimeout: if the build exceeds its deadline (the whole Maven process group is killed)
     """
     try:
         # In some commits it is necessary to update dependencies version or repositories url in order to allow Maven to
@@ -178,16 +197,18 @@ def sq_scanner_geoserver(project: str, verbose: bool = False) -> bool:
                   '-U -B -Dmaven.compiler.failOnError=false'
 
         if verbose:
-            mvn = subprocess.run(cmd,
-                                 cwd=Path(__file__).parent.joinpath("temp/clones/" + project),
-                                 shell=True)
+            mvn = run_with_deadline('build', cmd,
+                                    cwd=Path(__file__).parent.joinpath("temp/clones/" + project),
+                                    shell=True, capture=False)
             return True if mvn.returncode == 0 else False
         else:
-            mvn = subprocess.run(cmd,
-                                 cwd=Path(__file__).parent.joinpath("temp/clones/" + project),
-                                 shell=True, stdout=subprocess.PIPE, text=True)
+            mvn = run_with_deadline('build', cmd,
+                                    cwd=Path(__file__).parent.joinpath("temp/clones/" + project),
+                                    shell=True)
             return True if mvn.returncode == 0 and "BUILD SUCCESS" in mvn.stdout else False
 
+    except StageTimeout:
+        raise
     except Exception as e:
         logging.error("Error building with Maven", exc_info=e)
         return False
@@ -199,11 +220,18 @@ def sq_wait_ce(component: str) -> bool:
 
     :param component: the component of which we are interested in task
     :return: True if task succeeds, False otherwise
+    :raise StageTimeout: if the task does not end within the deadline of the processing (queued tasks are canceled)
     """
+    start_time = time.monotonic()
     while True:
         time.sleep(5)
+        if deadline_expired('ce', start_time):
+            print(' Processing canceled')
+            sq_cancel_ce(component)
+            raise StageTimeout('ce', STAGE_DEADLINES['ce'])
         try:
-            response = sq_get('api/ce/component', {'component': component})
+            response = sq_get('api/ce/component', {'component': component},
+                              timeout=time_left('ce', start_time, SQ_REQUEST_TIMEOUT))
             if len(response['queue']):
                 print_appendable('.')
             elif response['current']['status'] == 'SUCCESS':
@@ -216,6 +244,21 @@ def sq_wait_ce(component: str) -> bool:
             continue
 
 
+def sq_cancel_ce(component: str) -> None:
+    """
+    Cancels the queued tasks of a component (tasks already in progress cannot be canceled)
+
+    :param component: the component of which we are interested in tasks
+    :return: None
+    """
+    try:
+        response = sq_get('api/ce/component', {'component': component})
+        for task in response['queue']:
+            sq_post('api/ce/cancel', {'id': task['id']})
+    except (RequestException, ValueError, KeyError) as e:
+        logging.error("Error canceling CE tasks", exc_info=e)
+
+
 def sq_measure(component: str, metric: str) -> Optional[str | int]:
     """
     Queries the server to get the measurement of a metric
@@ -0,0 +1,155 @@
+"""
+This module supervises the stages of the analysis that could hang (Maven build, SonarQube start-up and CE processing,
+submodules update): each stage has a deadline, after which its whole process group is killed, and the commits whose
+analysis fails or times out are pushed onto a retry queue processed at the end of the run with an exponential backoff.
+"""
+
+import os
+import signal
+import subprocess
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from print_utils import print_info, print_warning
+
+# Deadline (in seconds) of each stage, None means no deadline
+STAGE_DEADLINES: dict[str, Optional[float]] = {
+    'startup': 600,  # SonarQube server start-up
+    'submodules': 600,  # git submodule update
+    'build': 3600,  # Maven build with Sonar Scanner analysis
+    'ce': 1800,  # SonarQube Compute Engine processing
+}
+
+RETRIES = 2  # number of retry rounds of the failed commits
+BACKOFF = 60  # seconds to wait before the first retry round, doubled at each round
+
+
+class StageTimeout(Exception):
+    """
+    Raised when a stage of the analysis exceeds its deadline
+    """
+
+    def __init__(self, stage: str, deadline: float):
+        super().__init__(f'{stage} timeout ({deadline}s)')
+        self.stage = stage
+        self.deadline = deadline
+
+
+def run_with_deadline(stage: str, cmd: str | list[str], cwd: Path, shell: bool = False,
+                      capture: bool = True) -> subprocess.CompletedProcess:
+    """
+    Runs a command in a new process group, killing the whole group if it exceeds the deadline of the stage
+
+    :param stage: stage of the analysis (key of STAGE_DEADLINES)
+    :param cmd: command to run
+    :param cwd: working directory
+    :param shell: if True the command is run through the shell
+    :param capture: if True the standard output is captured as text, otherwise it is printed to the console
+    :return: the completed process
+    """
+    deadline = STAGE_DEADLINES.get(stage)
+    process = subprocess.Popen(cmd, cwd=cwd, shell=shell, stdout=subprocess.PIPE if capture else None, text=True,
+                               start_new_session=True)
+    try:
+        stdout, _ = process.communicate(timeout=deadline)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process)
+        raise StageTimeout(stage, deadline)
+    except BaseException:
+        kill_process_group(process)
+        raise
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout)
+
+
+def kill_process_group(process: subprocess.Popen) -> None:
+    """
+    Kills a process with all its children (the process must be the leader of its group)
+
+    :param process: process to kill
+    :return: None
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.communicate()
+
+
+def deadline_expired(stage: str, start_time: float) -> bool:
+    """
+    Checks if the deadline of a stage started at the given time has expired
+
+    :param stage: stage of the analysis (key of STAGE_DEADLINES)
+    :param start_time: start time of the stage (as returned by time.monotonic())
+    :return: True if the deadline has expired, False otherwise
+    """
+    deadline = STAGE_DEADLINES.get(stage)
+    return deadline is not None and time.monotonic() - start_time > deadline
+
+
+def time_left(stage: str, start_time: float, limit: Optional[float] = None) -> Optional[float]:
+    """
+    Returns the time left before the deadline of a stage started at the given time
+
+    :param stage: stage of the analysis (key of STAGE_DEADLINES)
+    :param start_time: start time of the stage (as returned by time.monotonic())
+    :param limit: upper bound of the returned time
+    :return: seconds left (at least 1), bounded by the limit, or the limit if the stage has no deadline
+    """
+    deadline = STAGE_DEADLINES.get(stage)
+    if deadline is None:
+        return limit
+    left = max(deadline - (time.monotonic() - start_time), 1)
+    return left if limit is None else min(left, limit)
+
+
+class RetryQueue:
+    """
+    Queue of the commits whose analysis failed, processed at the end of the run in rounds separated by an exponential
+    backoff
+    """
+
+    def __init__(self, retries: int = RETRIES, backoff: float = BACKOFF):
+        """
+        :param retries: number of retry rounds
+        :param backoff: seconds to wait before the first round, doubled at each round
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.queue: deque = deque()
+
+    def push(self, item: Any, reason: str) -> None:
+        """
+        Pushes a failed item onto the queue
+
+        :param item: item to retry
+        :param reason: reason of the failure
+        :return: None
+        """
+        print_warning(f'  Analysis failed ({reason}), commit queued for retry')
+        self.queue.append(item)
+
+    def process(self, attempt: Callable[[Any], dict[str, Any]]) -> dict[Any, dict[str, Any]]:
+        """
+        Retries the queued items until they succeed or the rounds are over
+
+        :param attempt: function analyzing an item, returning its row (with the FAILURE column set if it fails)
+        :return: the row of the last attempt of each retried item
+        """
+        rows = {}
+        for retry in range(self.retries):
+            if not self.queue:
+                break
+            wait = self.backoff * 2 ** retry
+            print_info(f'  Retrying {len(self.queue)} failed commits in {wait}s (round {retry + 1}/{self.retries})')
+            time.sleep(wait)
+
+            pending = list(self.queue)
+            self.queue.clear()
+            for item in pending:
+                rows[item] = attempt(item)
+                if rows[item]['FAILURE'] is not None:
+                    self.queue.append(item)
+        return rows